@@ -1,9 +1,9 @@
+import hashlib
+import itertools
 import os
-import requests
-import threading
-from flask import Flask, request, jsonify
+import re
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram.ext import AIORateLimiter, Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,161 +11,192 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN") or "8306200181:AAHP56BkD6eZOcqjI6MZNrMdU7M06S0tIrs"
 BLOCKONOMICS_API_KEY = os.getenv("BLOCKONOMICS_API_KEY")
 
+# Public base URL for webhook mode (Render exposes its hostname); unset means long polling
+RENDER_EXTERNAL_HOSTNAME = os.getenv("RENDER_EXTERNAL_HOSTNAME")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or (f"https://{RENDER_EXTERNAL_HOSTNAME}" if RENDER_EXTERNAL_HOSTNAME else None)
+PORT = int(os.getenv("PORT", 10000))
+# Sent by Telegram in X-Telegram-Bot-Api-Secret-Token and checked by PTB. Set WEBHOOK_SECRET in production;
+# the fallback is derived from the token, so it is only as private as the token itself
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TELEGRAM_TOKEN.encode()).hexdigest()[:32]
+
 # Admin user ID (replace with actual admin user ID)
 ADMIN_USER_ID = 7260656020
 
-# Sample digital items
+# Sample digital items (prices in integer satoshis; convert to BTC only for display)
 ITEMS = {
-    "item1": {"name": "Dark Secret File", "price_btc": 0.0001, "file_path": "items/secret.pdf"},
-    "item2": {"name": "Forbidden Archive", "price_btc": 0.0002, "file_path": "items/archive.zip"}
+    "item1": {"name": "Dark Secret File", "price_sat": 10_000, "file_path": "items/secret.pdf"},
+    "item2": {"name": "Forbidden Archive", "price_sat": 20_000, "file_path": "items/archive.zip"}
 }
 
-# Flask app for Blockonomics callback
-app = Flask(__name__)
-
-@app.route(f'/{TELEGRAM_TOKEN}', methods=['POST'])
-def webhook():
-    data = request.get_json()
-    print("Received data:", data)  # Log the incoming data
-    # Create a Telegram update object from the received data
-    update = Update.de_json(data, bot)
-    dispatcher.process_update(update)
-    return "OK", 200
+# Static keyboards, built once at import
+ADMIN_PANEL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("View Item List", callback_data="view_items")],
+    [InlineKeyboardButton("Add New Item", callback_data="add_item")],
+    [InlineKeyboardButton("Remove Item", callback_data="remove_item")],
+    [InlineKeyboardButton("Back", callback_data="back_to_main")]
+])
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("View Admin Panel", callback_data="admin_panel")]
+])
+
+# callback_data of an item's button in the remove-item keyboard
+REMOVE_RE = re.compile(r"^remove_(?P<key>[A-Za-z0-9_-]{1,32})$")
+
+# Suffixes for new item keys, starting past the highest existing itemN; never reused, so keys cannot collide
+_item_ids = itertools.count(
+    max((int(key[4:]) for key in ITEMS if key.startswith("item") and key[4:].isdigit()), default=0) + 1
+)
+
+# Item-list keyboard, built on first use and reset whenever ITEMS changes
+_remove_item_markup = None
+
+def build_remove_item_markup():
+    global _remove_item_markup
+    if _remove_item_markup is None:
+        keyboard = [
+            [InlineKeyboardButton(item['name'], callback_data=f"remove_{key}")] for key, item in ITEMS.items()
+        ]
+        keyboard.append([InlineKeyboardButton("Back", callback_data="back_to_main")])
+        _remove_item_markup = InlineKeyboardMarkup(keyboard)
+    return _remove_item_markup
+
+
+def invalidate_item_keyboards():
+    global _remove_item_markup
+    _remove_item_markup = None
 
 # Admin interface
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.message.from_user.id
+    if update.callback_query:
+        await update.callback_query.answer()
+
+    user_id = update.effective_user.id
     if user_id != ADMIN_USER_ID:
-        await update.message.reply_text("You are not authorized to access this panel.")
+        await update.effective_message.reply_text("You are not authorized to access this panel.")
         return
 
     stats = f"Total items: {len(ITEMS)}\nTotal revenue: 0 BTC"
+    await update.effective_message.reply_text(f"Admin Panel\n\n{stats}", reply_markup=ADMIN_PANEL_MARKUP)
 
-    keyboard = [
-        [InlineKeyboardButton("View Item List", callback_data="view_items")],
-        [InlineKeyboardButton("Add New Item", callback_data="add_item")],
-        [InlineKeyboardButton("Remove Item", callback_data="remove_item")],
-        [InlineKeyboardButton("Back", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(f"Admin Panel\n\n{stats}", reply_markup=reply_markup)
+# View Item List
+async def view_items(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+
+    user_id = update.effective_user.id
+    if user_id != ADMIN_USER_ID:
+        await update.effective_message.reply_text("You are not authorized to view items.")
+        return
+
+    if not ITEMS:
+        await update.effective_message.reply_text("No items yet.")
+        return
+
+    lines = [f"{item['name']} - {item['price_sat'] / 100_000_000:.8f} BTC" for item in ITEMS.values()]
+    await update.effective_message.reply_text("Items:\n\n" + "\n".join(lines))
 
 # Handle Add Item
 async def add_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.message.from_user.id
+    await update.callback_query.answer()
+
+    user_id = update.effective_user.id
     if user_id != ADMIN_USER_ID:
-        await update.message.reply_text("You are not authorized to add items.")
+        await update.effective_message.reply_text("You are not authorized to add items.")
         return
 
-    await update.message.reply_text("Please send the name of the new item.")
+    await update.effective_message.reply_text("Please send the name of the new item.")
     context.user_data['action'] = 'add_item'
 
 
 async def process_add_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('action') == 'add_item':
+    action = context.user_data.get('action')
+
+    if action == 'add_item':
         item_name = update.message.text
         await update.message.reply_text(f"Enter the file path for {item_name}:")
         context.user_data['item_name'] = item_name
         context.user_data['action'] = 'add_item_path'
         return
 
-    if context.user_data.get('action') == 'add_item_path':
+    if action == 'add_item_path':
         item_path = update.message.text
-        item_price = 0.0005
+        item_price = 50_000
 
-        ITEMS[f"item{len(ITEMS)+1}"] = {
+        ITEMS[f"item{next(_item_ids)}"] = {
             'name': context.user_data['item_name'],
-            'price_btc': item_price,
+            'price_sat': item_price,
             'file_path': item_path
         }
+        invalidate_item_keyboards()
 
         await update.message.reply_text(f"Item {context.user_data['item_name']} added successfully.")
         context.user_data.clear()
 
 # Remove Item
 async def remove_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.message.from_user.id
+    await update.callback_query.answer()
+
+    user_id = update.effective_user.id
     if user_id != ADMIN_USER_ID:
-        await update.message.reply_text("You are not authorized to remove items.")
+        await update.effective_message.reply_text("You are not authorized to remove items.")
         return
 
-    keyboard = [
-        [InlineKeyboardButton(item['name'], callback_data=f"remove_{key}")] for key, item in ITEMS.items()
-    ]
-    keyboard.append([InlineKeyboardButton("Back", callback_data="back_to_main")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Select an item to remove:", reply_markup=reply_markup)
+    await update.effective_message.reply_text("Select an item to remove:", reply_markup=build_remove_item_markup())
 
 
 async def confirm_remove_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    item_key = query.data.split("_")[1]
+    await query.answer()
+
+    user_id = update.effective_user.id
+    if user_id != ADMIN_USER_ID:
+        await query.message.reply_text("You are not authorized to remove items.")
+        return
+
+    item_key = context.matches[0]["key"]
     if item_key in ITEMS:
         del ITEMS[item_key]
+        invalidate_item_keyboards()
         await query.message.reply_text("Item removed successfully.")
     else:
         await query.message.reply_text("Item not found.")
 
 # Back to Main Menu
 async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [InlineKeyboardButton("View Admin Panel", callback_data="admin_panel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Back to main menu.", reply_markup=reply_markup)
-
-# Handle Button Callbacks
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+    await update.callback_query.answer()
 
-    if query.data == "admin_panel":
-        await admin_panel(update, context)
-
-    elif query.data == "add_item":
-        await add_item(update, context)
-    elif query.data == "remove_item":
-        await remove_item(update, context)
-    elif query.data.startswith("remove_"):
-        await confirm_remove_item(update, context)
-    elif query.data == "back_to_main":
-        await back_to_main(update, context)
-
-# Webhook Configuration
-def set_webhook():
-    webhook_url = f"https://{os.getenv('RENDER_EXTERNAL_HOSTNAME')}/{TELEGRAM_TOKEN}"
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/setWebhook?url={webhook_url}"
-    response = requests.get(url)
-    return response.text
+    await update.effective_message.reply_text("Back to main menu.", reply_markup=MAIN_MENU_MARKUP)
 
 # Main entry point for Telegram bot
 def run_telegram_bot():
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    # Throttle outbound calls to Telegram's global/per-chat limits and retry on RetryAfter
+    app = Application.builder().token(TELEGRAM_TOKEN).rate_limiter(AIORateLimiter(max_retries=3)).build()
 
     app.add_handler(CommandHandler("start", admin_panel))
     app.add_handler(CommandHandler("admin", admin_panel))
-    app.add_handler(CallbackQueryHandler(button_callback))
-    
-    # Set the webhook
-    set_webhook()
+    # Buttons are routed by PTB on callback_data; remove_item must precede the remove_<key> prefix
+    app.add_handler(CallbackQueryHandler(admin_panel, pattern="^admin_panel$"))
+    app.add_handler(CallbackQueryHandler(view_items, pattern="^view_items$"))
+    app.add_handler(CallbackQueryHandler(add_item, pattern="^add_item$"))
+    app.add_handler(CallbackQueryHandler(remove_item, pattern="^remove_item$"))
+    app.add_handler(CallbackQueryHandler(confirm_remove_item, pattern=REMOVE_RE))
+    app.add_handler(CallbackQueryHandler(back_to_main, pattern="^back_to_main$"))
+    # Text replies drive the add-item wizard started by the Add New Item button
+    app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, process_add_item))
+
+    if not WEBHOOK_URL:
+        # Long-poll: Telegram holds each getUpdates open until an update arrives (up to 20 s)
+        app.run_polling(timeout=20, poll_interval=0.0, bootstrap_retries=-1)
+        return
 
-    # Start Flask to handle incoming webhook requests
+    # run_webhook registers the webhook itself through the bot's pooled async HTTP client
     app.run_webhook(
         listen="0.0.0.0",
-        port=10000,
-        url_path=TELEGRAM_TOKEN,
-        webhook_url=f"https://{os.getenv('RENDER_EXTERNAL_HOSTNAME')}/{TELEGRAM_TOKEN}"
+        port=PORT,
+        url_path="telegram",
+        webhook_url=f"{WEBHOOK_URL}/telegram",
+        secret_token=WEBHOOK_SECRET
     )
 
-# Flask app for Blockonomics callback (run Flask in a thread)
-def run_flask():
-    app.run(debug=False, host="0.0.0.0", port=10000, use_reloader=False)  # Disable reloader in production
-
 
 if __name__ == "__main__":
-    # Run Flask and Telegram bot in separate threads
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.start()
-
-    # Run Telegram bot
     run_telegram_bot()